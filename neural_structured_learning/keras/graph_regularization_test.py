@@ -17,7 +17,7 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
-import os
+import tempfile
 
 from absl.testing import parameterized
 import neural_structured_learning.configs as configs
@@ -25,7 +25,6 @@ from neural_structured_learning.keras import graph_regularization
 import numpy as np
 import tensorflow as tf
 
-from google.protobuf import text_format
 from tensorflow.python.framework import test_util  # pylint: disable=g-direct-tensorflow-import
 
 FEATURE_NAME = 'x'
@@ -50,7 +49,8 @@ def make_feature_spec(input_shape, max_neighbors):
       LABEL_NAME:
           tf.io.FixedLenFeature([1],
                                 tf.float32,
-                                default_value=tf.constant([0.0])),
+                                default_value=tf.constant([0.0],
+                                                          dtype=tf.float32)),
   }
   for i in range(max_neighbors):
     nbr_feature_key = '{}{}_{}'.format(NBR_FEATURE_PREFIX, i, FEATURE_NAME)
@@ -58,10 +58,41 @@ def make_feature_spec(input_shape, max_neighbors):
     feature_spec[nbr_feature_key] = tf.io.FixedLenFeature(
         input_shape, tf.float32)
     feature_spec[nbr_weight_key] = tf.io.FixedLenFeature(
-        [1], tf.float32, default_value=tf.constant([0.0]))
+        [1], tf.float32, default_value=tf.constant([0.0], dtype=tf.float32))
   return feature_spec
 
 
+def _make_example(x, y, neighbors=()):
+  """Builds a `tf.train.Example` with the given feature values.
+
+  Args:
+    x: An array-like of floats for the input feature.
+    y: An array-like of floats for the label.
+    neighbors: A sequence of `(neighbor_x, neighbor_weight)` pairs, one for
+      each neighbor of the sample.
+
+  Returns:
+    A `tf.train.Example` instance.
+  """
+  example = tf.train.Example()
+  feature = example.features.feature
+  feature[FEATURE_NAME].float_list.value.extend(np.ravel(x))
+  feature[LABEL_NAME].float_list.value.extend(np.ravel(y))
+  for i, (nbr_x, nbr_weight) in enumerate(neighbors):
+    nbr_feature_key = '{}{}_{}'.format(NBR_FEATURE_PREFIX, i, FEATURE_NAME)
+    nbr_weight_key = '{}{}{}'.format(NBR_FEATURE_PREFIX, i, NBR_WEIGHT_SUFFIX)
+    feature[nbr_feature_key].float_list.value.extend(np.ravel(nbr_x))
+    feature[nbr_weight_key].float_list.value.extend(np.ravel(nbr_weight))
+  return example
+
+
+def _set_dense_kernel(dense_layer, weights):
+  """Sets the kernel of a built, bias-free `dense_layer` to `weights`."""
+  kernel_shape = dense_layer.kernel.shape.as_list()
+  dense_layer.set_weights(
+      [np.asarray(weights, dtype=np.float32).reshape(kernel_shape)])
+
+
 def build_linear_sequential_model(input_shape, weights, num_output=1):
   model = tf.keras.Sequential()
   model.add(
@@ -72,18 +103,19 @@ def build_linear_sequential_model(input_shape, weights, num_output=1):
           input_shape=input_shape,
           use_bias=False,
           name='dense',
-          kernel_initializer=tf.keras.initializers.Constant(weights)))
+          kernel_initializer='zeros'))
+  _set_dense_kernel(model.get_layer('dense'), weights)
   return model
 
 
 def build_linear_functional_model(input_shape, weights, num_output=1):
   inputs = tf.keras.Input(shape=input_shape, name=FEATURE_NAME)
   outputs = tf.keras.layers.Dense(
-      num_output,
-      use_bias=False,
-      kernel_initializer=tf.keras.initializers.Constant(weights))(
+      num_output, use_bias=False, name='dense', kernel_initializer='zeros')(
           inputs)
-  return tf.keras.Model(inputs=inputs, outputs=outputs)
+  model = tf.keras.Model(inputs=inputs, outputs=outputs)
+  _set_dense_kernel(model.get_layer('dense'), weights)
+  return model
 
 
 def build_linear_subclass_model(input_shape, weights, num_output=1):
@@ -96,10 +128,12 @@ def build_linear_subclass_model(input_shape, weights, num_output=1):
       self.init_weights = weights
       self.num_output = num_output
       self.dense = tf.keras.layers.Dense(
-          num_output,
-          use_bias=False,
-          name='dense',
-          kernel_initializer=tf.keras.initializers.Constant(weights))
+          num_output, use_bias=False, name='dense', kernel_initializer='zeros')
+
+    def build(self, input_shape):
+      self.dense.build(input_shape[FEATURE_NAME])
+      _set_dense_kernel(self.dense, self.init_weights)
+      self.built = True
 
     def call(self, inputs):
       return self.dense(inputs[FEATURE_NAME])
@@ -114,36 +148,133 @@ def build_linear_subclass_model(input_shape, weights, num_output=1):
   return CustomLinearModel(weights, num_output)
 
 
-def make_dataset(example_proto, input_shape, training, max_neighbors):
+def make_dataset(example, input_shape, training, max_neighbors):
   """Construct a tf.data.Dataset from the given Example."""
+  # The dataset holds a single example, so `training` has no effect on it.
+  del training
 
-  def make_parse_example_fn(feature_spec):
+  def make_parse_batch_fn(feature_spec):
 
-    def parse_example(serialized_example_proto):
-      """Extracts relevant fields from the example_proto."""
-      feature_dict = tf.io.parse_single_example(serialized_example_proto,
-                                                feature_spec)
+    def parse_batch(serialized_batch):
+      """Extracts relevant fields from a batch of serialized Examples."""
+      feature_dict = tf.io.parse_example(serialized_batch, feature_spec)
       return feature_dict, feature_dict.pop(LABEL_NAME)
 
-    return parse_example
+    return parse_batch
 
-  example = text_format.Parse(example_proto, tf.train.Example())
   serialized_example = example.SerializeToString()
-  dataset = tf.data.Dataset.from_tensors(
-      tf.convert_to_tensor(serialized_example))
-  if training:
-    dataset = dataset.shuffle(10)
-  dataset = dataset.map(
-      make_parse_example_fn(make_feature_spec(input_shape, max_neighbors)))
+  dataset = tf.data.Dataset.from_tensor_slices([serialized_example])
+  # Batch before parsing so that a single vectorized parse_example call handles
+  # the whole batch.
   dataset = dataset.batch(1)
+  dataset = dataset.map(
+      make_parse_batch_fn(make_feature_spec(input_shape, max_neighbors)),
+      num_parallel_calls=tf.data.experimental.AUTOTUNE)
   return dataset
 
 
+# Lazily created by _get_strategy() and shared by the distributed tests.
+_MIRRORED_STRATEGY = None
+
+
+def _get_strategy():
+  """Returns a `tf.distribute.MirroredStrategy`, creating it on first use."""
+  global _MIRRORED_STRATEGY
+  if _MIRRORED_STRATEGY is None:
+    _MIRRORED_STRATEGY = tf.distribute.MirroredStrategy()
+  return _MIRRORED_STRATEGY
+
+
+def _create_and_compile_graph_reg_model(model_fn, weight, max_neighbors,
+                                        metrics):
+  """Creates and compiles a graph regularized model.
+
+  Args:
+    model_fn: A function that builds a linear regression model.
+    weight: Initial value for the weights variable in the linear regressor.
+    max_neighbors: The maximum number of neighbors for graph regularization.
+    metrics: A tuple of metric names to compile the graph regularized model
+      with.
+
+  Returns:
+    A pair containing the unregularized model and the graph regularized
+    model as `tf.keras.Model` instances.
+  """
+  model = model_fn((2,), weight)
+  graph_reg_config = configs.make_graph_reg_config(
+      max_neighbors=max_neighbors, multiplier=1)
+  graph_reg_model = graph_regularization.GraphRegularization(
+      model, graph_reg_config)
+  graph_reg_model.compile(
+      optimizer=tf.keras.optimizers.SGD(LEARNING_RATE),
+      loss='MSE',
+      metrics=list(metrics) or None)
+  return model, graph_reg_model
+
+
+def get_compiled_graph_reg_model(model_fn,
+                                 weight,
+                                 max_neighbors,
+                                 metrics=(),
+                                 distributed_strategy=None):
+  """Creates and compiles a graph regularized model under an optional strategy.
+
+  Args:
+    model_fn: A function that builds a linear regression model.
+    weight: Initial value for the weights variable in the linear regressor.
+    max_neighbors: The maximum number of neighbors for graph regularization.
+    metrics: A tuple of metric names to compile the graph regularized model
+      with.
+    distributed_strategy: An instance of `tf.distribute.Strategy` specifying
+      the distributed strategy to create the model under.
+
+  Returns:
+    A pair containing the unregularized model and the graph regularized
+    model as `tf.keras.Model` instances.
+  """
+  if distributed_strategy:
+    with distributed_strategy.scope():
+      return _create_and_compile_graph_reg_model(model_fn, weight,
+                                                 max_neighbors, metrics)
+  return _create_and_compile_graph_reg_model(model_fn, weight, max_neighbors,
+                                             metrics)
+
+
+def make_dataset_from_arrays(x, y, neighbor_xs, neighbor_weights, training):
+  """Construct a tf.data.Dataset from feature values without using protos.
+
+  The resulting dataset has the same structure as the one produced by
+  `make_dataset` for the equivalent `tf.train.Example`.
+
+  Args:
+    x: An array-like of floats for the input feature of a single sample.
+    y: An array-like of floats for the label of the sample.
+    neighbor_xs: A sequence of array-likes, one for each neighbor's feature.
+    neighbor_weights: A sequence of floats, one for each neighbor's weight.
+    training: Unused, kept for parity with `make_dataset`.
+
+  Returns:
+    A `tf.data.Dataset` yielding a single batch of size 1.
+  """
+  del training
+
+  def to_tensor(values):
+    return tf.constant(np.ravel(values), dtype=tf.float32)
+
+  feature_dict = {FEATURE_NAME: to_tensor(x)}
+  for i, (nbr_x, nbr_weight) in enumerate(zip(neighbor_xs, neighbor_weights)):
+    nbr_feature_key = '{}{}_{}'.format(NBR_FEATURE_PREFIX, i, FEATURE_NAME)
+    nbr_weight_key = '{}{}{}'.format(NBR_FEATURE_PREFIX, i, NBR_WEIGHT_SUFFIX)
+    feature_dict[nbr_feature_key] = to_tensor(nbr_x)
+    feature_dict[nbr_weight_key] = to_tensor(nbr_weight)
+  return tf.data.Dataset.from_tensors((feature_dict, to_tensor(y))).batch(1)
+
+
 class GraphRegularizationTest(tf.test.TestCase, parameterized.TestCase):
 
   def test_predict_regularized_model(self):
     model = build_linear_functional_model(
-        input_shape=(2,), weights=np.array([1.0, -1.0]))
+        input_shape=(2,), weights=np.array([1.0, -1.0], dtype=np.float32))
     inputs = {FEATURE_NAME: tf.constant([[5.0, 3.0]])}
 
     graph_reg_model = graph_regularization.GraphRegularization(model)
@@ -155,7 +286,7 @@ class GraphRegularizationTest(tf.test.TestCase, parameterized.TestCase):
 
   def test_predict_base_model(self):
     model = build_linear_functional_model(
-        input_shape=(2,), weights=np.array([1.0, -1.0]))
+        input_shape=(2,), weights=np.array([1.0, -1.0], dtype=np.float32))
     inputs = {FEATURE_NAME: tf.constant([[5.0, 3.0]])}
 
     graph_reg_model = graph_regularization.GraphRegularization(model)
@@ -165,8 +296,30 @@ class GraphRegularizationTest(tf.test.TestCase, parameterized.TestCase):
 
     self.assertAllEqual([[1 * 5.0 + (-1.0) * 3.0]], prediction)
 
+  def test_make_dataset_matches_arrays(self):
+    x0 = np.array([[2.0, 3.0]], dtype=np.float32)
+    x0_nbr0 = np.array([[2.5, 3.0]], dtype=np.float32)
+    x0_nbr1 = np.array([[2.0, 2.0]], dtype=np.float32)
+    y0 = np.array([[0.0]], dtype=np.float32)
+
+    example = _make_example(
+        x0, y0, neighbors=[(x0_nbr0, 1.0), (x0_nbr1, 0.5)])
+    proto_dataset = make_dataset(
+        example, input_shape=[2], training=True, max_neighbors=2)
+    array_dataset = make_dataset_from_arrays(
+        x0,
+        y0,
+        neighbor_xs=[x0_nbr0, x0_nbr1],
+        neighbor_weights=[1.0, 0.5],
+        training=True)
+
+    proto_features, proto_label = next(iter(proto_dataset))
+    array_features, array_label = next(iter(array_dataset))
+    self.assertAllClose(array_features, proto_features)
+    self.assertAllClose(array_label, proto_label)
+
   def _train_and_check_params(self,
-                              example,
+                              dataset,
                               model_fn,
                               dense_layer_index,
                               max_neighbors,
@@ -178,7 +331,7 @@ class GraphRegularizationTest(tf.test.TestCase, parameterized.TestCase):
     This uses a linear regressor as the base model.
 
     Args:
-      example: An instance of `tf.train.Example`.
+      dataset: A `tf.data.Dataset` containing a single training batch.
       model_fn: A function that builds a linear regression model.
       dense_layer_index: The index of the dense layer in the linear regressor.
       max_neighbors: The maximum number of neighbors for graph regularization.
@@ -189,37 +342,11 @@ class GraphRegularizationTest(tf.test.TestCase, parameterized.TestCase):
         the distributed strategy to use for training.
     """
 
-    dataset = make_dataset(
-        example, input_shape=[2], training=True, max_neighbors=max_neighbors)
-
-    def _create_and_compile_graph_reg_model(model_fn, weight, max_neighbors):
-      """Creates and compiles a graph regularized model.
-
-      Args:
-        model_fn: A function that builds a linear regression model.
-        weight: Initial value for the weights variable in the linear regressor.
-        max_neighbors: The maximum number of neighbors for graph regularization.
-
-      Returns:
-        A pair containing the unregularized model and the graph regularized
-        model as `tf.keras.Model` instances.
-      """
-      model = model_fn((2,), weight)
-      graph_reg_config = configs.make_graph_reg_config(
-          max_neighbors=max_neighbors, multiplier=1)
-      graph_reg_model = graph_regularization.GraphRegularization(
-          model, graph_reg_config)
-      graph_reg_model.compile(
-          optimizer=tf.keras.optimizers.SGD(LEARNING_RATE), loss='MSE')
-      return model, graph_reg_model
-
-    if distributed_strategy:
-      with distributed_strategy.scope():
-        model, graph_reg_model = _create_and_compile_graph_reg_model(
-            model_fn, weight, max_neighbors)
-    else:
-      model, graph_reg_model = _create_and_compile_graph_reg_model(
-          model_fn, weight, max_neighbors)
+    model, graph_reg_model = get_compiled_graph_reg_model(
+        model_fn,
+        weight,
+        max_neighbors,
+        distributed_strategy=distributed_strategy)
 
     graph_reg_model.fit(x=dataset, epochs=1, steps_per_epoch=1)
 
@@ -231,50 +358,25 @@ class GraphRegularizationTest(tf.test.TestCase, parameterized.TestCase):
     self.assertAllClose(expected_weight,
                         model.layers[dense_layer_index].weights[0].value())
 
-  @parameterized.named_parameters([
-      ('_sequential', 0, build_linear_sequential_model),
-      ('_functional', 1, build_linear_functional_model),
-      ('_subclass', 0, build_linear_subclass_model),
-  ])
-  @test_util.run_in_graph_and_eager_modes
-  def test_graph_reg_model_one_neighbor_training(self, dense_layer_index,
-                                                 model_fn):
-    w = np.array([[4.0], [-3.0]])
-    x0 = np.array([[2.0, 3.0]])
-    x0_nbr0 = np.array([[2.5, 3.0]])
-    y0 = np.array([[0.0]])
-
-    example = """
-                features {
-                  feature {
-                    key: "x"
-                    value: { float_list { value: [ 2.0, 3.0 ] } }
-                  }
-                  feature {
-                    key: "NL_nbr_0_x"
-                    value: { float_list { value: [ 2.5, 3.0 ] } }
-                  }
-                  feature {
-                    key: "NL_nbr_0_weight"
-                    value: { float_list { value: 1.0 } }
-                  }
-                  feature {
-                    key: "y"
-                    value: { float_list { value: 0.0 } }
-                  }
-                }
-              """
-
-    y_hat = np.dot(x0, w)  # -1.0
-    y_nbr = np.dot(x0_nbr0, w)  # 1.0
+  def _test_training_with_one_neighbor(self, dense_layer_index, model_fn):
+    w = np.array([[4.0], [-3.0]], dtype=np.float32)
+    x0 = np.array([[2.0, 3.0]], dtype=np.float32)
+    x0_nbr0 = np.array([[2.5, 3.0]], dtype=np.float32)
+    y0 = np.array([[0.0]], dtype=np.float32)
 
+    dataset = make_dataset_from_arrays(
+        x0, y0, neighbor_xs=[x0_nbr0], neighbor_weights=[1.0], training=True)
+
+    # y_hat = np.dot(x0, w) = -1.0
+    # y_nbr = np.dot(x0_nbr0, w) = 1.0
+    #
     # The graph loss term is (y_hat - y_nbr)^2 since graph regularization is
-    # done on the final predictions.
-    grad_w = 2 * (y_hat - y0) * x0.T + 2 * (y_hat - y_nbr) * (
-        x0 - x0_nbr0).T  # [[-2.0], [-6.0]]
+    # done on the final predictions. So, the gradient is:
+    # grad_w = 2 * (y_hat - y0) * x0.T + 2 * (y_hat - y_nbr) * (x0 - x0_nbr0).T
+    grad_w = np.array([[-2.0], [-6.0]], dtype=np.float32)
 
     self._train_and_check_params(
-        example,
+        dataset,
         model_fn,
         dense_layer_index,
         max_neighbors=1,
@@ -285,52 +387,31 @@ class GraphRegularizationTest(tf.test.TestCase, parameterized.TestCase):
                                         dense_layer_index,
                                         model_fn,
                                         distributed_strategy=None):
-    w = np.array([[4.0], [-3.0]])
-    x0 = np.array([[2.0, 3.0]])
-    x0_nbr0 = np.array([[2.5, 3.0]])
-    x0_nbr1 = np.array([[2.0, 2.0]])
-    y0 = np.array([[0.0]])
-
-    example = """
-                features {
-                  feature {
-                    key: "x"
-                    value: { float_list { value: [ 2.0, 3.0 ] } }
-                  }
-                  feature {
-                    key: "NL_nbr_0_x"
-                    value: { float_list { value: [ 2.5, 3.0 ] } }
-                  }
-                  feature {
-                    key: "NL_nbr_0_weight"
-                    value: { float_list { value: 1.0 } }
-                  }
-                  feature {
-                    key: "NL_nbr_1_x"
-                    value: { float_list { value: [ 2.0, 2.0 ] } }
-                  }
-                  feature {
-                    key: "NL_nbr_1_weight"
-                    value: { float_list { value: 1.0 } }
-                  }
-                  feature {
-                    key: "y"
-                    value: { float_list { value: 0.0 } }
-                  }
-                }
-              """
-
-    y_hat = np.dot(x0, w)  # -1.0
-    y_nbr0 = np.dot(x0_nbr0, w)  # 1.0
-    y_nbr1 = np.dot(x0_nbr1, w)  # 2.0
-
+    w = np.array([[4.0], [-3.0]], dtype=np.float32)
+    x0 = np.array([[2.0, 3.0]], dtype=np.float32)
+    x0_nbr0 = np.array([[2.5, 3.0]], dtype=np.float32)
+    x0_nbr1 = np.array([[2.0, 2.0]], dtype=np.float32)
+    y0 = np.array([[0.0]], dtype=np.float32)
+
+    dataset = make_dataset_from_arrays(
+        x0,
+        y0,
+        neighbor_xs=[x0_nbr0, x0_nbr1],
+        neighbor_weights=[1.0, 1.0],
+        training=True)
+
+    # y_hat = np.dot(x0, w) = -1.0
+    # y_nbr0 = np.dot(x0_nbr0, w) = 1.0
+    # y_nbr1 = np.dot(x0_nbr1, w) = 2.0
+    #
     # The distance metric for the graph loss is 'L2'. So, the graph loss term is
-    # [(y_hat - y_nbr_0)^2 + (y_hat - y_nbr_1)^2] / 2
-    grad_w = 2 * (y_hat - y0) * x0.T + (y_hat - y_nbr0) * (x0 - x0_nbr0).T + (
-        y_hat - y_nbr1) * (x0 - x0_nbr1).T  # [[-3.0], [-9.0]]
+    # [(y_hat - y_nbr_0)^2 + (y_hat - y_nbr_1)^2] / 2 and the gradient is:
+    # grad_w = 2 * (y_hat - y0) * x0.T + (y_hat - y_nbr0) * (x0 - x0_nbr0).T +
+    #          (y_hat - y_nbr1) * (x0 - x0_nbr1).T
+    grad_w = np.array([[-3.0], [-9.0]], dtype=np.float32)
 
     self._train_and_check_params(
-        example,
+        dataset,
         model_fn,
         dense_layer_index,
         max_neighbors=2,
@@ -343,11 +424,32 @@ class GraphRegularizationTest(tf.test.TestCase, parameterized.TestCase):
       ('_functional', 1, build_linear_functional_model),
       ('_subclass', 0, build_linear_subclass_model),
   ])
-  @test_util.run_in_graph_and_eager_modes
+  def test_graph_reg_model_one_neighbor_training(self, dense_layer_index,
+                                                 model_fn):
+    self._test_training_with_one_neighbor(dense_layer_index, model_fn)
+
+  # Graph mode is covered once per gradient scenario rather than once per
+  # parameterized variant. The cached session is installed as the default so
+  # that Keras and self.evaluate() share the same variables.
+  @test_util.run_deprecated_v1
+  def test_graph_reg_model_one_neighbor_training_graph_mode(self):
+    with self.cached_session():
+      self._test_training_with_one_neighbor(0, build_linear_sequential_model)
+
+  @parameterized.named_parameters([
+      ('_sequential', 0, build_linear_sequential_model),
+      ('_functional', 1, build_linear_functional_model),
+      ('_subclass', 0, build_linear_subclass_model),
+  ])
   def test_graph_reg_model_two_neighbors_training(self, dense_layer_index,
                                                   model_fn):
     self._test_training_with_two_neighbors(dense_layer_index, model_fn)
 
+  @test_util.run_deprecated_v1
+  def test_graph_reg_model_two_neighbors_training_graph_mode(self):
+    with self.cached_session():
+      self._test_training_with_two_neighbors(0, build_linear_sequential_model)
+
   @parameterized.named_parameters([
       ('_sequential', 0, build_linear_sequential_model),
       ('_functional', 1, build_linear_functional_model),
@@ -359,11 +461,11 @@ class GraphRegularizationTest(tf.test.TestCase, parameterized.TestCase):
     self._test_training_with_two_neighbors(
         dense_layer_index,
         model_fn,
-        distributed_strategy=tf.distribute.MirroredStrategy())
+        distributed_strategy=_get_strategy())
 
   def _train_and_check_eval_results(self,
-                                    train_example,
-                                    test_example,
+                                    train_dataset,
+                                    test_dataset,
                                     model_fn,
                                     max_neighbors,
                                     weight,
@@ -373,8 +475,8 @@ class GraphRegularizationTest(tf.test.TestCase, parameterized.TestCase):
     This uses a linear regressor as the base model.
 
     Args:
-      train_example: An instance of `tf.train.Example` used for training.
-      test_example: An instance of `tf.train.Example` used for evaluation.
+      train_dataset: A `tf.data.Dataset` used for training.
+      test_dataset: A `tf.data.Dataset` used for evaluation.
       model_fn: A function that builds a linear regression model.
       max_neighbors: The maximum number of neighbors for graph regularization.
       weight: Initial value for the weights variable in the linear regressor.
@@ -382,57 +484,31 @@ class GraphRegularizationTest(tf.test.TestCase, parameterized.TestCase):
         the distributed strategy to use for training.
     """
 
-    train_dataset = make_dataset(
-        train_example,
-        input_shape=[2],
-        training=True,
-        max_neighbors=max_neighbors)
-
-    test_dataset = make_dataset(
-        test_example, input_shape=[2], training=False, max_neighbors=0)
-
-    def _create_and_compile_graph_reg_model(model_fn, weight, max_neighbors):
-      """Creates and compiles a graph regularized model.
-
-      Args:
-        model_fn: A function that builds a linear regression model.
-        weight: Initial value for the weights variable in the linear regressor.
-        max_neighbors: The maximum number of neighbors for graph regularization.
-
-      Returns:
-        A pair containing the unregularized model and the graph regularized
-        model as `tf.keras.Model` instances.
-      """
-      model = model_fn((2,), weight)
-      graph_reg_config = configs.make_graph_reg_config(
-          max_neighbors=max_neighbors, multiplier=1)
-      graph_reg_model = graph_regularization.GraphRegularization(
-          model, graph_reg_config)
-      graph_reg_model.compile(
-          optimizer=tf.keras.optimizers.SGD(LEARNING_RATE),
-          loss='MSE',
-          metrics=['accuracy'])
-      return model, graph_reg_model
-
-    if distributed_strategy:
-      with distributed_strategy.scope():
-        model, graph_reg_model = _create_and_compile_graph_reg_model(
-            model_fn, weight, max_neighbors)
-    else:
-      model, graph_reg_model = _create_and_compile_graph_reg_model(
-          model_fn, weight, max_neighbors)
+    model, graph_reg_model = get_compiled_graph_reg_model(
+        model_fn,
+        weight,
+        max_neighbors,
+        metrics=('accuracy',),
+        distributed_strategy=distributed_strategy)
 
     graph_reg_model.fit(x=train_dataset, epochs=1, steps_per_epoch=1)
 
     # Evaluating the graph-regularized model should yield the same results
     # as evaluating the base model as the former involves just using the
     # base model for evaluation.
-    graph_reg_model_eval_results = dict(
-        zip(graph_reg_model.metrics_names,
-            graph_reg_model.evaluate(x=test_dataset)))
-    base_model_eval_results = dict(
-        zip(model.metrics_names, model.evaluate(x=test_dataset)))
-    self.assertAllClose(base_model_eval_results, graph_reg_model_eval_results)
+    graph_reg_model_eval_results = graph_reg_model.evaluate(x=test_dataset)
+    base_model_eval_results = model.evaluate(x=test_dataset)
+    self.assertEqual(model.metrics_names, graph_reg_model.metrics_names)
+    try:
+      self.assertAllClose(base_model_eval_results, graph_reg_model_eval_results)
+    except AssertionError:
+      # Compare the results keyed by metric name for a more informative error.
+      self.assertAllClose(
+          dict(zip(model.metrics_names, base_model_eval_results)),
+          dict(
+              zip(graph_reg_model.metrics_names,
+                  graph_reg_model_eval_results)))
+      raise
 
   @parameterized.named_parameters([
       ('_sequential', build_linear_sequential_model),
@@ -440,52 +516,26 @@ class GraphRegularizationTest(tf.test.TestCase, parameterized.TestCase):
       ('_subclass', build_linear_subclass_model),
   ])
   def test_graph_reg_model_evaluate(self, model_fn):
-    w = np.array([[4.0], [-3.0]])
-
-    train_example = """
-                features {
-                  feature {
-                    key: "x"
-                    value: { float_list { value: [ 2.0, 3.0 ] } }
-                  }
-                  feature {
-                    key: "NL_nbr_0_x"
-                    value: { float_list { value: [ 2.5, 3.0 ] } }
-                  }
-                  feature {
-                    key: "NL_nbr_0_weight"
-                    value: { float_list { value: 1.0 } }
-                  }
-                  feature {
-                    key: "NL_nbr_1_x"
-                    value: { float_list { value: [ 2.0, 2.0 ] } }
-                  }
-                  feature {
-                    key: "NL_nbr_1_weight"
-                    value: { float_list { value: 1.0 } }
-                  }
-                  feature {
-                    key: "y"
-                    value: { float_list { value: 0.0 } }
-                  }
-                }
-              """
-
-    test_example = """
-                features {
-                  feature {
-                    key: "x"
-                    value: { float_list { value: [ 4.0, 2.0 ] } }
-                  }
-                  feature {
-                    key: "y"
-                    value: { float_list { value: 4.0 } }
-                  }
-                }
-              """
+    w = np.array([[4.0], [-3.0]], dtype=np.float32)
+
+    x0 = np.array([[2.0, 3.0]], dtype=np.float32)
+    x0_nbr0 = np.array([[2.5, 3.0]], dtype=np.float32)
+    x0_nbr1 = np.array([[2.0, 2.0]], dtype=np.float32)
+    y0 = np.array([[0.0]], dtype=np.float32)
+    x1 = np.array([[4.0, 2.0]], dtype=np.float32)
+    y1 = np.array([[4.0]], dtype=np.float32)
+
+    train_dataset = make_dataset_from_arrays(
+        x0,
+        y0,
+        neighbor_xs=[x0_nbr0, x0_nbr1],
+        neighbor_weights=[1.0, 1.0],
+        training=True)
+    test_dataset = make_dataset_from_arrays(
+        x1, y1, neighbor_xs=[], neighbor_weights=[], training=False)
     self._train_and_check_eval_results(
-        train_example,
-        test_example,
+        train_dataset,
+        test_dataset,
         model_fn,
         max_neighbors=2,
         weight=w,
@@ -493,7 +543,7 @@ class GraphRegularizationTest(tf.test.TestCase, parameterized.TestCase):
 
   def _test_graph_reg_model_save(self, model_fn):
     """Template for testing model saving and loading."""
-    w = np.array([[4.0], [-3.0]])
+    w = np.array([[4.0], [-3.0]], dtype=np.float32)
     base_model = model_fn((2,), w)
     graph_reg_config = configs.make_graph_reg_config(
         max_neighbors=1, multiplier=1)
@@ -507,10 +557,14 @@ class GraphRegularizationTest(tf.test.TestCase, parameterized.TestCase):
     # Run the model before saving it. This is necessary for subclassed models.
     inputs = {FEATURE_NAME: tf.constant([[5.0, 3.0]])}
     graph_reg_model.predict(inputs, steps=1, batch_size=1)
-    saved_model_dir = os.path.join(self.get_temp_dir(), 'saved_model')
-    graph_reg_model.save(saved_model_dir)
-
-    loaded_model = tf.keras.models.load_model(saved_model_dir)
+    saved_model_dir = tempfile.mkdtemp(
+        prefix='graphreg_', dir=self.get_temp_dir())
+    # Only the trainable weights are compared below, so neither the optimizer
+    # state nor the compiled loss and metrics need to be saved or restored.
+    graph_reg_model.save(
+        saved_model_dir, include_optimizer=False, save_format='tf')
+
+    loaded_model = tf.keras.models.load_model(saved_model_dir, compile=False)
     self.assertEqual(
         len(loaded_model.trainable_weights),
         len(graph_reg_model.trainable_weights))